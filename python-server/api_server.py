@@ -1,24 +1,47 @@
 import asyncio
-import json
+import atexit
+import ctypes
 import logging
+import logging.handlers
+import multiprocessing
+import multiprocessing.connection
 import os
+import queue
+import signal
+import ssl
+import sys
 from datetime import datetime
-from typing import Optional, Dict, Any
-from dotenv import load_dotenv
+from typing import Optional, Dict, Any, Final
 import aiohttp
 from aiohttp import web
 import websockets
 import aiohttp_cors
+import orjson
 
+# A escrita no stderr roda na thread do QueueListener para não bloquear o event loop
+_log_queue: queue.SimpleQueue = queue.SimpleQueue()
+_log_listener = logging.handlers.QueueListener(_log_queue, logging.StreamHandler())
+_log_listener.start()
+atexit.register(_log_listener.stop)
 logging.basicConfig(
-    level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s"
+    level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s",
+    handlers=[logging.handlers.QueueHandler(_log_queue)],
 )
 logger = logging.getLogger(__name__)
 
-load_dotenv()
-PORT = int(os.getenv("PORT", 8000))
-OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
-RECALL_API_KEY = os.getenv("RECALL_API_KEY")
+# .env só é lido fora de produção; com ENV=production as variáveis vêm do ambiente
+if os.getenv("ENV") != "production":
+    from dotenv import load_dotenv
+    load_dotenv()
+
+PORT: Final = int(os.getenv("PORT", 8000))
+WEB_CONCURRENCY: Final = int(os.getenv("WEB_CONCURRENCY", 1))
+OPENAI_API_KEY: Final = os.getenv("OPENAI_API_KEY")
+RECALL_API_KEY: Final = os.getenv("RECALL_API_KEY")
+PUBLIC_URL: Final = os.getenv("PUBLIC_URL")
+FRONTEND_URL: Final = os.getenv("FRONTEND_URL")
+# Endereço do relay que o bot recebe; só depende do ambiente, então é montado uma vez
+BOT_WS_URL: Final = f"{PUBLIC_URL.replace('https://', 'wss://')}/ws" if PUBLIC_URL else None
 
 if not OPENAI_API_KEY:
     raise ValueError("OPENAI_API_KEY must be set in environment variables")
@@ -64,20 +87,31 @@ Zoom etiquette:
       }
 }
 
+# Personas são estáticas: o session.update de cada uma é serializado uma única vez
+_SESSION_UPDATE_JSON: Dict[str, str] = {
+    key: orjson.dumps({
+        "type": "session.update",
+        "session": {
+            "instructions": persona["instructions"], "input_audio_format": "pcm16",
+            "output_audio_format": "pcm16", "modalities": ["text", "audio"],
+            "voice": {"id": "ash"},  # Corrected format
+            "turn_detection": {"type": "server_vad"}
+        },
+    }).decode()
+    for key, persona in personas.items()
+}
+
 class RecallAPIClient:
-    def __init__(self, api_key: str):
-        self.api_key = api_key
+    def __init__(self, session: aiohttp.ClientSession):
+        # A sessão já carrega os headers de autenticação da Recall
+        self.session = session
         self.base_url = "https://us-west-2.recall.ai/api/v1"
         
     async def create_bot(self, meeting_url: str, bot_name: str, persona_key: str) -> Dict[str, Any]:
-        backend_url = os.getenv("PUBLIC_URL")
-        if not backend_url: raise ValueError("PUBLIC_URL environment variable is not set on Railway.")
+        if not BOT_WS_URL: raise ValueError("PUBLIC_URL environment variable is not set on Railway.")
+        if not FRONTEND_URL: raise ValueError("FRONTEND_URL environment variable is not set on Railway.")
 
-        frontend_url = os.getenv("FRONTEND_URL")
-        if not frontend_url: raise ValueError("FRONTEND_URL environment variable is not set on Railway.")
-
-        ws_url = f"{backend_url.replace('https://', 'wss://')}/ws?persona={persona_key}"
-        final_url = f"{frontend_url}?wss={ws_url}"
+        final_url = f"{FRONTEND_URL}?wss={BOT_WS_URL}?persona={persona_key}"
         
         payload = {
             "meeting_url": meeting_url, "bot_name": bot_name,
@@ -85,90 +119,130 @@ class RecallAPIClient:
             "variant": {"zoom": "web_4_core"}
         }
         
-        async with aiohttp.ClientSession() as session:
-            async with session.post(
-                f"{self.base_url}/bot", json=payload,
-                headers={"Authorization": self.api_key, "Content-Type": "application/json"}
-            ) as response:
-                if response.status in [200, 201]:
-                    data = await response.json()
-                    logger.info(f"Bot created successfully: {data.get('id')}")
-                    return data
-                else:
-                    text = await response.text()
-                    logger.error(f"Failed to create bot: {response.status} - {text}")
-                    raise Exception(f"Failed to create bot: {text}")
+        async with self.session.post(f"{self.base_url}/bot", data=orjson.dumps(payload)) as response:
+            if response.status in (200, 201):
+                data = await response.json()
+                logger.info("Bot created successfully: %s", data.get('id'))
+                return data
+            else:
+                # Lê só o início do corpo de erro para não bufferizar páginas grandes;
+                # read(n) devolve o que já chegou, então acumulamos até 4 KiB ou EOF
+                body = b""
+                while len(body) < 4096 and (chunk := await response.content.read(4096 - len(body))):
+                    body += chunk
+                text = body.decode("utf-8", "replace")
+                logger.error("Failed to create bot: %s - %s", response.status, text)
+                raise Exception(f"Failed to create bot: {text}")
+
+# Carregar os certificados da CA é caro; um único contexto serve todas as conexões com a OpenAI
+OPENAI_SSL_CONTEXT = ssl.create_default_context()
+
+RECALL_SESSION = web.AppKey("recall_session", aiohttp.ClientSession)
+RECALL_CLIENT = web.AppKey("recall_client", RecallAPIClient)
 
 async def connect_to_openai_with_persona(persona_key: str):
     # Modelo atualizado conforme sua solicitação
     uri = "wss://api.openai.com/v1/realtime?model=gpt-realtime-2025-08-28"
-    persona = personas.get(persona_key)
-    if not persona: raise ValueError(f"Persona '{persona_key}' not found.")
+    session_update = _SESSION_UPDATE_JSON.get(persona_key)
+    if not session_update: raise ValueError(f"Persona '{persona_key}' not found.")
 
+    ws = None
     try:
         ws = await websockets.connect(
             uri,
             extra_headers={"Authorization": f"Bearer {OPENAI_API_KEY}", "OpenAI-Beta": "realtime=v1"},
-            subprotocols=["realtime"],
+            subprotocols=["realtime"], ssl=OPENAI_SSL_CONTEXT,
+            ping_interval=15, ping_timeout=20, max_size=2**20, compression=None,
         )
-        logger.info(f"Successfully connected to OpenAI with persona: {persona_key}")
+        logger.info("Successfully connected to OpenAI with persona: %s", persona_key)
 
-        event = json.loads(await ws.recv())
-        if event.get("type") != "session.created":
-            raise Exception(f"Expected session.created, got {event.get('type')}")
+        # O session.update vai junto com o handshake em vez de esperar o session.created,
+        # economizando um round-trip até a OpenAI; ela processa os eventos em ordem
+        await ws.send(session_update)
+        session_created = await ws.recv()
+        event_type = orjson.loads(session_created).get("type")
+        if event_type != "session.created":
+            raise Exception(f"Expected session.created, got {event_type}")
         
-        update_session = {
-            "type": "session.update",
-            "session": {
-                "instructions": persona["instructions"], "input_audio_format": "pcm16",
-                "output_audio_format": "pcm16", "modalities": ["text", "audio"],
-                "voice": {"id": "ash"},  # Corrected format
-                "turn_detection": {"type": "server_vad"}
-            },
-        }
-        await ws.send(json.dumps(update_session))
-        return ws, event
+        return ws, session_created
     except Exception as e:
-        logger.error(f"Failed to connect to OpenAI: {str(e)}")
+        logger.error("Failed to connect to OpenAI: %s", e)
+        # O chamador nunca recebe o socket nesse caso, então ele é fechado aqui
+        if ws is not None:
+            await ws.close()
         raise
 
 async def websocket_handler(request):
-    ws = web.WebSocketResponse(protocols=["realtime"])
+    ws = web.WebSocketResponse(
+        protocols=["realtime"], heartbeat=20.0, max_msg_size=1_048_576, compress=False
+    )
     await ws.prepare(request)
     
-    raw_persona = request.query.get('persona', 'munffett')
-    persona_key = raw_persona.split('?')[0]
+    # O RealtimeClient do navegador acrescenta "?model=..." à URL do relay,
+    # então o valor chega como "munffett?model=..."
+    persona_key = request.query.get('persona', 'munffett').partition('?')[0]
+    if persona_key not in personas:
+        # Falha antes de abrir qualquer conexão com a OpenAI
+        logger.warning("Rejecting WebSocket with unknown persona: %s", persona_key)
+        await ws.close(code=aiohttp.WSCloseCode.POLICY_VIOLATION, message=b'unknown persona')
+        return ws
     
-    logger.info(f"WebSocket connection initiated with persona: {persona_key}")
+    logger.info("WebSocket connection initiated with persona: %s", persona_key)
     openai_ws = None
     try:
         openai_ws, session_created = await connect_to_openai_with_persona(persona_key)
-        await ws.send_str(json.dumps(session_created))
+        await ws.send_str(session_created)
         
         # Lógica de relay com o "guardião" da persona
         async def relay_to_openai():
             async for msg in ws:
                 if msg.type == aiohttp.WSMsgType.TEXT:
-                    event = json.loads(msg.data)
-                    # SOLUÇÃO: Impede que o cliente sobrescreva as instruções
-                    if event.get("type") == "session.update" and "session" in event:
-                        if "instructions" in event["session"]:
-                            del event["session"]["instructions"]
+                    data = msg.data
+                    # Todo evento da API Realtime é um objeto JSON; o resto encerra a sessão
+                    if not data.lstrip().startswith('{'):
+                        raise ValueError("browser sent a non-JSON frame")
+                    # Só session.update precisa ser inspecionado; o áudio segue sem parse.
+                    # Frames com escapes \u também são parseados, pois poderiam disfarçar o tipo.
+                    if '"session.update"' in data or '\\u' in data:
+                        event = orjson.loads(data)
+                        # SOLUÇÃO: Impede que o cliente sobrescreva as instruções.
+                        if event.get("type") == "session.update":
+                            if "session" in event and "instructions" in event["session"]:
+                                del event["session"]["instructions"]
+                        # Frame parseado sempre sai re-serializado, nunca o texto original
+                        # (chaves duplicadas no original poderiam esconder "instructions").
+                        data = orjson.dumps(event).decode()
                     
-                    if not openai_ws.closed:
-                        await openai_ws.send(json.dumps(event))
+                    if openai_ws.closed:
+                        break
+                    await openai_ws.send(data)
+                # Frames BINARY do navegador são descartados: não passariam pelo guardião,
+                # e a API Realtime só aceita eventos em frames TEXT
                 elif msg.type == aiohttp.WSMsgType.ERROR:
                     break
 
         async def relay_from_openai():
             async for msg in openai_ws:
-                if not ws.closed:
+                if ws.closed:
+                    break
+                if isinstance(msg, bytes):
+                    await ws.send_bytes(msg)
+                else:
                     await ws.send_str(msg)
 
-        await asyncio.gather(relay_to_openai(), relay_from_openai())
+        # Quando um dos lados fecha, o outro é cancelado em vez de ficar preso no async for
+        relays = {asyncio.create_task(relay_to_openai()), asyncio.create_task(relay_from_openai())}
+        try:
+            done, _ = await asyncio.wait(relays, return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            for task in relays:
+                task.cancel()
+            await asyncio.gather(*relays, return_exceptions=True)
+        for task in done:
+            task.result()
         
     except Exception as e:
-        logger.error(f"WebSocket handler error: {e}")
+        logger.error("WebSocket handler error: %s", e)
     finally:
         if openai_ws and not openai_ws.closed: await openai_ws.close()
         if not ws.closed: await ws.close()
@@ -181,19 +255,43 @@ async def create_bot(request):
         if not meeting_url: return web.json_response({'error': 'meeting_url is required'}, status=400)
         
         persona_key = "munffett"
-        recall_client = RecallAPIClient(RECALL_API_KEY)
-        bot_data = await recall_client.create_bot(meeting_url, personas[persona_key]["name"], persona_key)
-        active_bots[bot_data['id']] = {'id': bot_data['id'], 'status': 'active'}
+        bot_data = await request.app[RECALL_CLIENT].create_bot(meeting_url, personas[persona_key]["name"], persona_key)
+        bot_id = bot_data['id']
+        active_bots[bot_id] = {'id': bot_id, 'status': 'active'}
         return web.json_response(bot_data)
     except Exception as e:
-        logger.error(f"Error creating bot: {e}")
+        logger.error("Error creating bot: %s", e)
         return web.json_response({'error': str(e)}, status=500)
 
+PING_ETAG_VALUE = 'ping-v1'
+PING_ETAG = f'"{PING_ETAG_VALUE}"'
+PING_HEADERS = {'Cache-Control': 'public, max-age=5, stale-while-revalidate=5', 'ETag': PING_ETAG}
+
 async def ping(request):
-    return web.json_response({'ok': True})
+    # Comparação fraca, como manda o If-None-Match: aceita listas, W/"..." e *
+    if_none_match = request.if_none_match or ()
+    if any(etag.value in (PING_ETAG_VALUE, '*') for etag in if_none_match):
+        return web.Response(status=304, headers=PING_HEADERS)
+    return web.json_response({'ok': True}, headers=PING_HEADERS)
+
+async def open_recall_session(app):
+    # Uma única sessão mantém o pool keep-alive/TLS com a Recall entre requisições
+    app[RECALL_SESSION] = aiohttp.ClientSession(
+        connector=aiohttp.TCPConnector(
+            limit=100, limit_per_host=32, keepalive_timeout=75, ttl_dns_cache=300,
+            enable_cleanup_closed=True,
+        ),
+        headers={"Authorization": RECALL_API_KEY, "Content-Type": "application/json"},
+    )
+    app[RECALL_CLIENT] = RecallAPIClient(app[RECALL_SESSION])
+
+async def close_recall_session(app):
+    await app[RECALL_SESSION].close()
 
 def create_app():
     app = web.Application()
+    app.on_startup.append(open_recall_session)
+    app.on_cleanup.append(close_recall_session)
     
     cors = aiohttp_cors.setup(app, defaults={
         "*": aiohttp_cors.ResourceOptions(
@@ -201,16 +299,63 @@ def create_app():
                 allow_headers="*", allow_methods="*")
     })
 
+    # O upgrade do /ws não precisa de cabeçalhos CORS
     app.router.add_get('/ws', websocket_handler)
-    app.router.add_post('/api/recall/create', create_bot)
-    app.router.add_get('/api/recall/ping', ping)
-
-    for route in list(app.router.routes()):
-        cors.add(route)
+    cors.add(app.router.add_post('/api/recall/create', create_bot))
+    cors.add(app.router.add_get('/api/recall/ping', ping))
         
     return app
 
-if __name__ == '__main__':
+def new_event_loop() -> asyncio.AbstractEventLoop:
+    # uvloop é opcional (não existe no Windows); sem ele usamos o loop padrão do asyncio
+    try:
+        import uvloop
+    except ImportError:
+        return asyncio.new_event_loop()
+    return uvloop.new_event_loop()
+
+PR_SET_PDEATHSIG: Final = 1  # <linux/prctl.h>
+
+def run_worker(parent_pid: Optional[int] = None):
+    if parent_pid is not None:
+        # Linux: recebe SIGTERM se o supervisor morrer (inclusive por kill -9)
+        ctypes.CDLL(None, use_errno=True).prctl(PR_SET_PDEATHSIG, signal.SIGTERM)
+        if os.getppid() != parent_pid:
+            return
     app = create_app()
-    logger.info(f"Starting API server on port {PORT}")
-    web.run_app(app, host='0.0.0.0', port=PORT)
+    web.run_app(
+        app, host='0.0.0.0', port=PORT, loop=new_event_loop(),
+        reuse_port=WEB_CONCURRENCY > 1,
+    )
+
+def supervise_workers():
+    # Cada worker tem seu próprio loop (e seu próprio active_bots); com SO_REUSEPORT
+    # o kernel distribui as conexões entre eles. O processo principal só supervisiona:
+    # se um worker cair, derruba os outros e sai com erro para o orquestrador reiniciar.
+    signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))
+    ctx = multiprocessing.get_context("spawn")
+    workers = [ctx.Process(target=run_worker, args=(os.getpid(),)) for _ in range(WEB_CONCURRENCY)]
+    try:
+        for worker in workers:
+            worker.start()
+        sentinels = {worker.sentinel: worker for worker in workers}
+        dead = sentinels[multiprocessing.connection.wait(list(sentinels))[0]]
+        dead.join()
+        logger.error("Worker %s exited unexpectedly (exit code %s); shutting down", dead.pid, dead.exitcode)
+        sys.exit(1)
+    finally:
+        for worker in workers:
+            if worker.is_alive():
+                worker.terminate()
+        for worker in workers:
+            worker.join()
+
+if __name__ == '__main__':
+    logger.info("Starting API server on port %s with %s worker(s)", PORT, WEB_CONCURRENCY)
+    if WEB_CONCURRENCY > 1:
+        # SO_REUSEPORT só balanceia no Linux, e o PR_SET_PDEATHSIG dos workers também é do Linux
+        if sys.platform != "linux":
+            raise SystemExit(f"WEB_CONCURRENCY > 1 is only supported on Linux (running on {sys.platform})")
+        supervise_workers()
+    else:
+        run_worker()
@@ -1,8 +1,8 @@
 import asyncio
-import json
 import logging
 import os
-from dotenv import load_dotenv
+from typing import Final
+import orjson
 import websockets
 from websockets.legacy.server import WebSocketServerProtocol, serve
 from websockets.legacy.client import connect
@@ -12,9 +12,13 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
-load_dotenv()
-PORT = int(os.getenv("PORT", 3000))
-OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
+# .env só é lido fora de produção; com ENV=production as variáveis vêm do ambiente
+if os.getenv("ENV") != "production":
+    from dotenv import load_dotenv
+    load_dotenv()
+
+PORT: Final = int(os.getenv("PORT", 3000))
+OPENAI_API_KEY: Final = os.getenv("OPENAI_API_KEY")
 
 if not OPENAI_API_KEY:
     raise ValueError("OPENAI_API_KEY must be set in .env file")
@@ -38,7 +42,7 @@ async def connect_to_openai():
 
         response = await ws.recv()
         try:
-            event = json.loads(response)
+            event = orjson.loads(response)
             if event.get("type") != "session.created":
                 raise Exception(f"Expected session.created, got {event.get('type')}")
             logger.info("Received session.created response")
@@ -52,14 +56,14 @@ async def connect_to_openai():
                     "voice": "alloy",
                 },
             }
-            await ws.send(json.dumps(update_session))
+            await ws.send(orjson.dumps(update_session).decode())
             logger.info("Sent session.create message")
 
             return (
                 ws,
                 event,
             )
-        except json.JSONDecodeError:
+        except orjson.JSONDecodeError:
             raise Exception(f"Invalid JSON response from OpenAI: {response}")
 
     except Exception as e:
@@ -84,6 +88,8 @@ class WebSocketRelay:
             return
 
         logger.info(f"Browser connected from {websocket.remote_address}")
+        # Logs por frame só em DEBUG: formatar cada delta de áudio domina o loop do relay
+        log_frames = logger.isEnabledFor(logging.DEBUG)
         self.message_queues[websocket] = []
         openai_ws = None
 
@@ -94,16 +100,17 @@ class WebSocketRelay:
 
             logger.info("Connected to OpenAI successfully!")
 
-            await websocket.send(json.dumps(session_created))
+            await websocket.send(orjson.dumps(session_created).decode())
             logger.info("Forwarded session.created to browser")
 
             while self.message_queues[websocket]:
                 message = self.message_queues[websocket].pop(0)
                 try:
-                    event = json.loads(message)
-                    logger.info(f'Relaying "{event.get("type")}" to OpenAI')
+                    event = orjson.loads(message)
+                    if log_frames:
+                        logger.debug('Relaying "%s" to OpenAI', event.get("type"))
                     await openai_ws.send(message)
-                except json.JSONDecodeError:
+                except orjson.JSONDecodeError:
                     logger.error(f"Invalid JSON from browser: {message}")
 
             async def handle_browser_messages():
@@ -111,10 +118,11 @@ class WebSocketRelay:
                     while True:
                         message = await websocket.recv()
                         try:
-                            event = json.loads(message)
-                            logger.info(f'Relaying "{event.get("type")}" to OpenAI')
+                            event = orjson.loads(message)
+                            if log_frames:
+                                logger.debug('Relaying "%s" to OpenAI', event.get("type"))
                             await openai_ws.send(message)
-                        except json.JSONDecodeError:
+                        except orjson.JSONDecodeError:
                             logger.error(f"Invalid JSON from browser: {message}")
                 except websockets.exceptions.ConnectionClosed as e:
                     logger.info(
@@ -127,12 +135,13 @@ class WebSocketRelay:
                     while True:
                         message = await openai_ws.recv()
                         try:
-                            event = json.loads(message)
-                            logger.info(
-                                f'Relaying "{event.get("type")}" from OpenAI: {message}'
-                            )
+                            event = orjson.loads(message)
+                            if log_frames:
+                                logger.debug(
+                                    'Relaying "%s" from OpenAI: %s', event.get("type"), message
+                                )
                             await websocket.send(message)
-                        except json.JSONDecodeError:
+                        except orjson.JSONDecodeError:
                             logger.error(f"Invalid JSON from OpenAI: {message}")
                 except websockets.exceptions.ConnectionClosed as e:
                     logger.info(